@@ -3,17 +3,21 @@ Experiment Assistant - Gradio UI
 A bilingual RAG assistant for online experimentation topics.
 """
 
+import asyncio
 import os
+from collections import OrderedDict
+
 from dotenv import load_dotenv
 
 from langchain_groq import ChatGroq
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 
 import gradio as gr
 
+from src.embeddings import load_embeddings
+from src.retriever import load_vectorstore
+
 # Load environment
 load_dotenv()
 
@@ -27,11 +31,19 @@ if not GROQ_API_KEY:
     )
 
 # Configuration
-EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
 TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+# The prompt asks for 3-5 sentences; capping decode length keeps latency
+# and cost proportional to what we actually want generated
+MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "256"))
 INDEX_DIR = os.getenv("INDEX_DIR", "faiss_index")
 RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+# Minimum cosine similarity of the best chunk for a question to be
+# considered on-topic; below it the LLM call is skipped entirely
+SCORE_THRESHOLD = float(os.getenv("SCORE_THRESHOLD", "0.2"))
+# Chunks are cut with this much shared text (see src/indexer.py), which
+# bounds how much deduplication looks for between retrieved chunks
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
 
 print("🚀 Initializing Experiment Assistant...")
 
@@ -40,7 +52,9 @@ print(f"🤖 Loading LLM: {LLM_MODEL}")
 llm = ChatGroq(
     model=LLM_MODEL,
     temperature=TEMPERATURE,
+    max_tokens=MAX_TOKENS,
     groq_api_key=GROQ_API_KEY,
+    streaming=True,
 )
 
 # Prompt template (bilingual)
@@ -62,82 +76,244 @@ PROMPT = PromptTemplate(
 
 # Load FAISS index
 print(f"📂 Loading FAISS index from: {INDEX_DIR}")
-embeddings = HuggingFaceEmbeddings(
-    model_name=EMBED_MODEL,
-    encode_kwargs={"normalize_embeddings": True},
-)
+embeddings = load_embeddings()
 
-vectorstore = FAISS.load_local(
-    INDEX_DIR,
-    embeddings,
-    allow_dangerous_deserialization=True
-)
+vectorstore = load_vectorstore(INDEX_DIR, embeddings)
 
-# Create QA chain
-qa_chain = RetrievalQA.from_chain_type(
-    llm=llm,
-    chain_type="stuff",
-    retriever=vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K}),
-    chain_type_kwargs={"prompt": PROMPT},
-)
+# Warm up the encoder and the index: the first embed_query pays for lazy
+# kernel/model initialization (1-2 s), better spent at startup than on
+# the first real request
+print("🔥 Warming up encoder and index...")
+_ = vectorstore.similarity_search_by_vector(embeddings.embed_query("warmup"), k=1)
+
+# Create QA chain (retrieval is done manually in answer_question so the
+# question is embedded exactly once, via the cache below)
+qa_chain = PROMPT | llm
 
 print("✅ Assistant ready!")
 
 
-def answer_question(question: str) -> str:
+class EmbeddingCoalescer:
     """
-    Answer a question using RAG.
-    
+    Batch concurrent query embeddings into single encoder calls.
+
+    Queries arriving within a short window are gathered and encoded as
+    one batch, amortizing the fixed per-call overhead of the encoder
+    when several Gradio requests are in flight at once.
+    """
+
+    def __init__(self, embeddings, max_batch: int = 16, max_wait_ms: float = 8.0):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker_task = None
+
+    async def embed(self, text: str) -> list:
+        """Embed one query, transparently batching with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        if self._worker_task is None or self._worker_task.done():
+            self._worker_task = loop.create_task(self._worker())
+
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first item, then drain up to max_batch items
+            # arriving within the coalescing window
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vecs = await asyncio.to_thread(self.embeddings.embed_documents, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (_, future), vec in zip(batch, vecs):
+                if not future.done():
+                    future.set_result(vec)
+
+
+coalescer = EmbeddingCoalescer(embeddings)
+
+# LRU cache of query embeddings keyed by normalized question text
+QUERY_CACHE_SIZE = 1024
+_query_cache: OrderedDict = OrderedDict()
+
+
+async def _embed_query(question: str) -> list:
+    """
+    Embed a normalized question, caching hot queries.
+
+    Repeat questions (demo examples, refresh clicks) skip the MiniLM
+    forward pass entirely on cache hits; misses go through the
+    coalescer so concurrent requests share one encoder call.
+    """
+    if question in _query_cache:
+        _query_cache.move_to_end(question)
+        return list(_query_cache[question])
+
+    vec = await coalescer.embed(question)
+
+    _query_cache[question] = tuple(vec)
+    if len(_query_cache) > QUERY_CACHE_SIZE:
+        _query_cache.popitem(last=False)
+
+    return list(vec)
+
+
+# HTML templates, parsed once at import time and filled per request with
+# format_map instead of re-evaluating f-strings in the handler
+OUTER_TMPL = (
+    "<div style='font-family: system-ui; max-width: 800px;'>"
+    "<h3 style='color: #2563eb; margin-bottom: 16px;'>💬 Réponse</h3>"
+    "<div style='padding: 16px; background: #f8fafc; border-radius: 8px; margin-bottom: 24px;'>{answer}</div>"
+    "<h3 style='color: #2563eb; margin-bottom: 16px;'>📚 Sources</h3>"
+    "{sources}"
+    "</div>"
+)
+
+# Fallback card for indexes built before cards were pre-rendered
+SOURCE_TMPL = """
+<div style='padding: 12px; margin-bottom: 12px; border: 1px solid #e2e8f0; border-radius: 8px; background: white;'>
+    <div style='font-weight: 600; margin-bottom: 4px;'>
+        <span style='background: #dbeafe; padding: 2px 8px; border-radius: 4px; font-size: 12px; margin-right: 8px;'>{lang}</span>
+        {title}
+    </div>
+    <a href='{url}' target='_blank' style='color: #3b82f6; text-decoration: none; font-size: 14px;'>{url}</a>
+    <div style='color: #64748b; margin-top: 8px; font-size: 14px;'>{snippet}...</div>
+</div>
+"""
+
+ERROR_TMPL = "<div style='color: #dc2626; padding: 16px;'>❌ Erreur : {error}</div>"
+
+
+def _cosine_similarity(score: float) -> float:
+    """
+    Normalize a raw FAISS score to cosine similarity.
+
+    Inner-product indexes return cosine directly (vectors are
+    pre-normalized); older L2 indexes return squared distance, where
+    d = 2 - 2*cos for unit vectors.
+    """
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        return score
+    return 1.0 - score / 2.0
+
+
+def _build_context(docs) -> str:
+    """
+    Join chunk texts for the prompt, trimming repeated overlap.
+
+    Neighboring chunks share up to CHUNK_OVERLAP characters by
+    construction, so retrieved chunks from the same article often repeat
+    text; trimming it sends fewer input tokens to the LLM.
+    """
+    parts = []
+    previous = ""
+
+    for doc in docs:
+        text = doc.page_content
+        limit = min(len(previous), len(text), CHUNK_OVERLAP)
+        for n in range(limit, 0, -1):
+            if previous.endswith(text[:n]):
+                text = text[n:]
+                break
+        if text:
+            parts.append(text)
+        previous = doc.page_content
+
+    return "\n\n".join(parts)
+
+
+def _render_sources(docs) -> str:
+    """Render the source cards for a list of retrieved documents."""
+    html_parts = []
+
+    for doc in docs:
+        snippet = doc.page_content[:200].replace("\n", " ")
+
+        # Cards are pre-rendered at index time; only the snippet varies
+        card_template = doc.metadata.get("html_card_template", SOURCE_TMPL)
+        html_parts.append(card_template.format_map({
+            "snippet": snippet,
+            "lang": doc.metadata.get("language", "??").upper(),
+            "title": doc.metadata.get("title", "Unknown"),
+            "url": doc.metadata.get("url", "#"),
+        }))
+
+    return "".join(html_parts)
+
+
+def _render_response(answer: str, sources_html: str) -> str:
+    """Render the full response HTML around a (possibly partial) answer."""
+    return OUTER_TMPL.format_map({"answer": answer, "sources": sources_html})
+
+
+async def answer_question(question: str):
+    """
+    Answer a question using RAG, streaming the answer as it is generated.
+
     Args:
         question: User's question
-        
-    Returns:
-        HTML formatted response with answer and sources
+
+    Yields:
+        HTML formatted response with the partial answer and sources
     """
     question = question.strip()
-    
+
     if not question:
-        return "<i>Veuillez entrer une question...</i>"
-    
+        yield "<i>Veuillez entrer une question...</i>"
+        return
+
     try:
-        # Generate answer
-        answer = qa_chain.run(question)
-        
-        # Retrieve source documents
-        docs = vectorstore.similarity_search(question, k=RETRIEVAL_K)
-        
-        # Format response with sources
-        html_parts = [
-            "<div style='font-family: system-ui; max-width: 800px;'>",
-            "<h3 style='color: #2563eb; margin-bottom: 16px;'>💬 Réponse</h3>",
-            f"<div style='padding: 16px; background: #f8fafc; border-radius: 8px; margin-bottom: 24px;'>{answer}</div>",
-            "<h3 style='color: #2563eb; margin-bottom: 16px;'>📚 Sources</h3>",
-        ]
-        
-        for i, doc in enumerate(docs, 1):
-            title = doc.metadata.get("title", "Unknown")
-            url = doc.metadata.get("url", "#")
-            lang = doc.metadata.get("language", "??").upper()
-            snippet = doc.page_content[:200].replace("\n", " ")
-            
-            source_html = f"""
-            <div style='padding: 12px; margin-bottom: 12px; border: 1px solid #e2e8f0; border-radius: 8px; background: white;'>
-                <div style='font-weight: 600; margin-bottom: 4px;'>
-                    <span style='background: #dbeafe; padding: 2px 8px; border-radius: 4px; font-size: 12px; margin-right: 8px;'>{lang}</span>
-                    {title}
-                </div>
-                <a href='{url}' target='_blank' style='color: #3b82f6; text-decoration: none; font-size: 14px;'>{url}</a>
-                <div style='color: #64748b; margin-top: 8px; font-size: 14px;'>{snippet}...</div>
-            </div>
-            """
-            html_parts.append(source_html)
-        
-        html_parts.append("</div>")
-        
-        return "".join(html_parts)
-    
+        # Embed once (cached + coalesced), retrieve by vector, then generate
+        # the answer from the same documents that become the source cards
+        qvec = await _embed_query(question.lower())
+        docs_and_scores = vectorstore.similarity_search_with_score_by_vector(
+            qvec, k=RETRIEVAL_K
+        )
+
+        # Off-topic question: answer locally instead of paying a Groq
+        # round-trip that would say the same thing
+        if (
+            not docs_and_scores
+            or _cosine_similarity(docs_and_scores[0][1]) < SCORE_THRESHOLD
+        ):
+            yield _render_response(
+                "Je ne trouve pas cette information dans ma base de connaissances.",
+                "",
+            )
+            return
+
+        docs = [doc for doc, _ in docs_and_scores]
+        sources_html = _render_sources(docs)
+        context = _build_context(docs)
+
+        # Stream token by token so perceived latency is time-to-first-token
+        # instead of the full completion time
+        answer = ""
+        async for chunk in qa_chain.astream({"context": context, "question": question}):
+            answer += chunk.content
+            yield _render_response(answer, sources_html)
+
     except Exception as e:
-        return f"<div style='color: #dc2626; padding: 16px;'>❌ Erreur : {str(e)}</div>"
+        yield ERROR_TMPL.format(error=e)
 
 
 # Gradio Interface
@@ -203,6 +379,10 @@ with gr.Blocks(
 
 
 if __name__ == "__main__":
+    # One shared process keeps the vectorstore, encoder and query cache
+    # warm; concurrent handlers are allowed so the coalescer can batch
+    # their embedding calls together
+    demo.queue(default_concurrency_limit=8)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
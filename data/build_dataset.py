@@ -4,6 +4,7 @@ Fetches 24 hand-selected articles (FR/EN) and pushes to HuggingFace Hub.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 import wikipediaapi
 from datasets import Dataset, DatasetDict, Features, Value, Sequence
@@ -14,6 +15,7 @@ load_dotenv()
 # Configuration
 HF_USER = os.getenv("HF_USER", "lmhdii")
 DS_NAME = f"{HF_USER}/experiment-assistant-dataset"
+MAX_FETCH_WORKERS = int(os.getenv("MAX_FETCH_WORKERS", "12"))
 
 # Curated Wikipedia pages (12 EN + 12 FR)
 CANDIDATES_EN = {
@@ -86,29 +88,39 @@ def fetch_page(wiki: wikipediaapi.Wikipedia, lang: str, title: str) -> Optional[
 
 
 def collect_language(lang: str, candidates: Dict[str, List[str]]) -> List[Dict]:
-    """Collect all pages for a given language."""
+    """Collect all pages for a given language (fetched in parallel)."""
     wiki = wikipediaapi.Wikipedia(
         language=lang,
         user_agent="experiment-assistant/1.0 (educational project)"
     )
-    
+
+    print(f"\n📚 Fetching {lang.upper()} articles ({MAX_FETCH_WORKERS} workers)...")
+
+    # Fetching is I/O bound (one HTTPS round-trip per page), so pull all
+    # candidate titles concurrently instead of paying the RTTs in sequence
+    titles = []
+    for topic_titles in candidates.values():
+        for title in topic_titles:
+            if title not in titles:
+                titles.append(title)
+
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        pages = dict(zip(titles, executor.map(
+            lambda title: fetch_page(wiki, lang, title), titles
+        )))
+
+    # Keep the original selection: first successful candidate per topic
     results = []
     seen_titles = set()
-    
-    print(f"\n📚 Fetching {lang.upper()} articles...")
-    
-    for topic, titles in candidates.items():
-        print(f"\n🔍 Topic: {topic}")
-        for title in titles:
-            if title in seen_titles:
-                continue
-            
-            row = fetch_page(wiki, lang, title)
+
+    for topic, topic_titles in candidates.items():
+        for title in topic_titles:
+            row = pages.get(title)
             if row and row["title"] not in seen_titles:
                 results.append(row)
                 seen_titles.add(row["title"])
                 break  # Found one, move to next topic
-    
+
     return results
 
 
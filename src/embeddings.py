@@ -0,0 +1,149 @@
+"""
+Embedding model loader for the Experiment Assistant.
+
+Prefers an ONNX-Runtime export of the MiniLM encoder (2-4x faster query
+embedding on CPU, ~4x smaller with int8 quantization) and falls back to
+the regular PyTorch sentence-transformer when no export is available.
+
+Export the model once with optimum:
+
+    optimum-cli export onnx \\
+        --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \\
+        onnx_minilm/
+    optimum-cli onnxruntime quantize \\
+        --arch bert --avx2 --onnx_model onnx_minilm -o onnx_minilm_int8
+
+Then point ONNX_MODEL_DIR at the exported directory in your .env.
+"""
+
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """MiniLM encoder running on ONNX Runtime (optimum export)."""
+
+    def __init__(self, model_dir: str, batch_size: int = EMBED_BATCH_SIZE):
+        """Load the exported ONNX model and its tokenizer."""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts to mean-pooled, L2-normalized vectors."""
+        import torch
+
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                batch, padding=True, truncation=True, return_tensors="pt"
+            )
+            with torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state
+
+            # Mean pooling over non-padding tokens, then L2 normalization
+            # (matches sentence-transformers' pooling for this model)
+            mask = inputs["attention_mask"].unsqueeze(-1).float()
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            batches.append(pooled.numpy())
+
+        return np.concatenate(batches, axis=0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents."""
+        return self._encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self._encode([text])[0].tolist()
+
+
+def encoder_id(embeddings: Embeddings) -> str:
+    """
+    Stable identifier of a loaded encoder (model + runtime variant).
+
+    The ONNX int8 export and the PyTorch model produce different
+    embedding spaces, as do different EMBED_MODEL values; anything that
+    caches vectors should key on this so an encoder switch invalidates
+    the cache instead of mixing spaces.
+    """
+    if isinstance(embeddings, OnnxMiniLMEmbeddings):
+        return f"onnx::{ONNX_MODEL_DIR}"
+    return f"pytorch::{EMBED_MODEL}"
+
+
+def get_tokenizer(embeddings: Embeddings):
+    """
+    Return the tokenizer behind an embedding model, or None.
+
+    Used by the indexer to sort chunks by real token length before
+    batching, so batches pad to similar sizes.
+    """
+    tokenizer = getattr(embeddings, "tokenizer", None)  # OnnxMiniLMEmbeddings
+    if tokenizer is not None:
+        return tokenizer
+
+    client = getattr(embeddings, "client", None)  # HuggingFaceEmbeddings
+    return getattr(client, "tokenizer", None)
+
+
+def _torch_device() -> str:
+    """Pick CUDA when available, otherwise use every CPU core."""
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+
+    # PyTorch can default to a single intra-op thread in some builds;
+    # MiniLM forward passes scale well across cores
+    torch.set_num_threads(os.cpu_count() or 1)
+    return "cpu"
+
+
+def load_embeddings() -> Embeddings:
+    """
+    Load the embedding model.
+
+    Uses the ONNX export when ONNX_MODEL_DIR is set and present,
+    otherwise the standard PyTorch sentence-transformer (on GPU with
+    FP16 weights when CUDA is available).
+    """
+    if ONNX_MODEL_DIR and Path(ONNX_MODEL_DIR).exists():
+        try:
+            print(f"⚡ Loading ONNX encoder from: {ONNX_MODEL_DIR}")
+            return OnnxMiniLMEmbeddings(ONNX_MODEL_DIR)
+        except ImportError:
+            print("⚠️  optimum[onnxruntime] not installed, falling back to PyTorch")
+
+    device = _torch_device()
+    model_kwargs = {"device": device}
+    if device == "cuda":
+        # FP16 halves weight memory and roughly doubles GPU throughput
+        model_kwargs["model_kwargs"] = {"torch_dtype": "float16"}
+
+    return HuggingFaceEmbeddings(
+        model_name=EMBED_MODEL,
+        model_kwargs=model_kwargs,
+        encode_kwargs={
+            "normalize_embeddings": True,
+            "batch_size": EMBED_BATCH_SIZE,
+        },
+    )
@@ -3,100 +3,268 @@ Create FAISS index from Wikipedia dataset.
 Chunks articles and creates vector embeddings for semantic search.
 """
 
+import hashlib
+import html
 import os
-import re
+import sqlite3
 from pathlib import Path
-from typing import List
-from tqdm import tqdm
+from typing import Dict, List, Tuple
+from uuid import uuid4
+
+import faiss
+import numpy as np
 
 from datasets import load_dataset
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
 from dotenv import load_dotenv
 
+try:
+    from src.embeddings import EMBED_MODEL, encoder_id, get_tokenizer, load_embeddings
+except ImportError:  # running as a script: python src/indexer.py
+    from embeddings import EMBED_MODEL, encoder_id, get_tokenizer, load_embeddings
+
 load_dotenv()
 
 # Configuration
 DATASET_NAME = os.getenv("DATASET_NAME", "lmhdii/experiment-assistant-dataset")
-EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "900"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+NUM_PROC = int(os.getenv("NUM_PROC", str(min(os.cpu_count() or 1, 8))))
 INDEX_DIR = Path(os.getenv("INDEX_DIR", "faiss_index"))
+EMBED_CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", "embed_cache.sqlite3"))
+
+# HNSW parameters: M graph neighbors per node, ef* search/build widths
+# (generous for this corpus size; recall at k=3 is effectively exact)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Static part of the source card shown in the UI, pre-rendered per chunk
+# at index time; only {snippet} is filled in per request (see app.py)
+SOURCE_CARD_TEMPLATE = """
+<div style='padding: 12px; margin-bottom: 12px; border: 1px solid #e2e8f0; border-radius: 8px; background: white;'>
+    <div style='font-weight: 600; margin-bottom: 4px;'>
+        <span style='background: #dbeafe; padding: 2px 8px; border-radius: 4px; font-size: 12px; margin-right: 8px;'>{lang}</span>
+        {title}
+    </div>
+    <a href='{url}' target='_blank' style='color: #3b82f6; text-decoration: none; font-size: 14px;'>{url}</a>
+    <div style='color: #64748b; margin-top: 8px; font-size: 14px;'>{{snippet}}...</div>
+</div>
+"""
+
+
+class EmbeddingCache:
+    """SQLite cache of chunk vectors keyed by content hash."""
+
+    def __init__(self, path: Path):
+        """Open (or create) the cache database."""
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)"
+        )
+
+    @staticmethod
+    def key(text: str, encoder: str) -> str:
+        """
+        Cache key for a chunk: hash of the text and the encoder identity.
+
+        Including the encoder means switching EMBED_MODEL or the ONNX
+        variant misses the cache instead of reusing vectors from a
+        different embedding space.
+        """
+        return hashlib.sha1(f"{encoder}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached vector for a key, or None."""
+        row = self.conn.execute(
+            "SELECT vec FROM embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_many(self, items):
+        """Store (key, vector) pairs."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+            ((key, vec.astype(np.float32).tobytes()) for key, vec in items),
+        )
+        self.conn.commit()
 
 
 def chunk_text(text: str, size: int = 900, overlap: int = 150) -> List[str]:
     """Split text into overlapping chunks."""
-    # Normalize whitespace
-    text = re.sub(r"\s+", " ", text or "").strip()
-    
+    # Normalize whitespace (C-level split/join, faster than a regex)
+    text = " ".join((text or "").split())
+
     if len(text) <= size:
         return [text]
-    
-    chunks = []
-    start = 0
-    
-    while start < len(text):
-        end = start + size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start = end - overlap
-    
-    return chunks
 
+    # One slice per chunk over precomputed offsets (linear time)
+    step = size - overlap
+    return [text[start:start + size] for start in range(0, len(text), step)]
+
+
+# Columns carried into each chunk's metadata
+METADATA_COLUMNS = ("id", "title", "url", "language", "source_type", "html_card_template")
+
+
+def _chunk_batch(batch: dict) -> dict:
+    """Chunk a batch of articles into one row per chunk (for Dataset.map)."""
+    out = {column: [] for column in ("text",) + METADATA_COLUMNS}
+
+    for i, text in enumerate(batch["text"]):
+        # Escape and render the static card HTML once per article instead
+        # of on every request in the app
+        card = SOURCE_CARD_TEMPLATE.format(
+            lang=html.escape(batch["language"][i].upper()),
+            title=html.escape(batch["title"][i]),
+            url=html.escape(batch["url"][i], quote=True),
+        )
+
+        for chunk in chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+            out["text"].append(chunk)
+            out["id"].append(batch["id"][i])
+            out["title"].append(batch["title"][i])
+            out["url"].append(batch["url"][i])
+            out["language"].append(batch["language"][i])
+            out["source_type"].append(batch["source_type"][i])
+            out["html_card_template"].append(card)
+
+    return out
 
-def load_documents() -> List[Document]:
-    """Load Wikipedia dataset and convert to LangChain documents."""
+
+def load_chunks() -> Tuple[List[str], List[Dict]]:
+    """
+    Load the Wikipedia dataset and chunk it into parallel arrays.
+
+    Returns (texts, metadatas) rather than Document objects: the whole
+    indexing pipeline works on plain lists, and Documents are only
+    materialized once when the docstore is filled in build_index.
+    """
     print(f"📥 Loading dataset: {DATASET_NAME}")
-    
+
     try:
         dataset = load_dataset(DATASET_NAME)
     except Exception as e:
         print(f"❌ Failed to load dataset: {e}")
         print("💡 Make sure the dataset was published successfully")
-        return []
-    
-    documents = []
-    
+        return [], []
+
+    texts = []
+    metadatas = []
+
     for split_name in ["wiki_en", "wiki_fr"]:
         if split_name not in dataset:
             print(f"⚠️  Split '{split_name}' not found, skipping")
             continue
-        
+
         split = dataset[split_name]
         print(f"\n📚 Processing {split_name}: {len(split)} articles")
-        
-        for row in tqdm(split, desc=f"Chunking {split_name}"):
-            metadata = {
-                "id": row["id"],
-                "title": row["title"],
-                "url": row["url"],
-                "language": row["language"],
-                "source_type": row["source_type"],
-            }
-            
-            # Chunk the article text
-            chunks = chunk_text(row["text"], size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
-            
-            for chunk in chunks:
-                doc = Document(page_content=chunk, metadata=metadata)
-                documents.append(doc)
-    
-    return documents
+
+        # Chunk via a batched Arrow map instead of a per-row Python loop:
+        # less interpreter overhead and parallel across cores for free
+        chunked = split.map(
+            _chunk_batch,
+            batched=True,
+            batch_size=32,
+            num_proc=min(NUM_PROC, len(split)) or None,
+            remove_columns=split.column_names,
+            desc=f"Chunking {split_name}",
+        )
+
+        # Columnar reads from the Arrow table, zipped into metadata dicts
+        texts.extend(chunked["text"])
+        columns = [chunked[column] for column in METADATA_COLUMNS]
+        metadatas.extend(
+            dict(zip(METADATA_COLUMNS, values)) for values in zip(*columns)
+        )
+
+    return texts, metadatas
 
 
-def build_index(documents: List[Document]) -> FAISS:
-    """Create FAISS index from documents."""
+def build_index(texts: List[str], metadatas: List[Dict]) -> FAISS:
+    """Create FAISS index from parallel chunk texts and metadata dicts."""
     print(f"\n🔧 Creating embeddings with: {EMBED_MODEL}")
-    
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBED_MODEL,
-        encode_kwargs={"normalize_embeddings": True}
+
+    embeddings = load_embeddings()
+
+    # Reuse vectors for unchanged chunks across rebuilds: keyed by content
+    # hash, only new or edited chunks go through the encoder
+    cache = EmbeddingCache(EMBED_CACHE_PATH)
+    encoder = encoder_id(embeddings)
+    keys = [EmbeddingCache.key(text, encoder) for text in texts]
+
+    vecs_by_pos = {}
+    for i, key in enumerate(keys):
+        vec = cache.get(key)
+        if vec is not None:
+            vecs_by_pos[i] = vec
+
+    missing = [i for i in range(len(texts)) if i not in vecs_by_pos]
+    print(f"🔨 Encoding {len(missing)} chunks ({len(vecs_by_pos)} cached)...")
+
+    if missing:
+        # Encode sorted by token length so each batch pads to similar
+        # lengths (less compute wasted on pad tokens), then restore
+        # original order. Character length is only a proxy for padding
+        # cost, so ask the encoder's tokenizer for real lengths.
+        missing_texts = [texts[i] for i in missing]
+        tokenizer = get_tokenizer(embeddings)
+        if tokenizer is not None:
+            lengths = [
+                len(ids)
+                for ids in tokenizer(missing_texts, truncation=True)["input_ids"]
+            ]
+        else:
+            lengths = [len(text) for text in missing_texts]
+        order = sorted(range(len(missing)), key=lengths.__getitem__)
+
+        sorted_vecs = embeddings.embed_documents([missing_texts[pos] for pos in order])
+        for pos, vec in zip(order, sorted_vecs):
+            vecs_by_pos[missing[pos]] = np.asarray(vec, dtype=np.float32)
+
+        cache.put_many(
+            (keys[missing[pos]], vecs_by_pos[missing[pos]]) for pos in order
+        )
+
+    vecs = np.stack([vecs_by_pos[i] for i in range(len(texts))]).astype(np.float32)
+
+    # HNSW graph over int8 scalar-quantized codes: search cost grows
+    # logarithmically with the corpus instead of linearly, and 1-byte
+    # codes keep memory traffic 4x below FP32, with negligible recall
+    # loss at small k
+    print("🔨 Building FAISS index (HNSW over int8 codes)...")
+    dim = vecs.shape[1]
+    index = faiss.IndexHNSWSQ(
+        dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
     )
-    
-    print(f"🔨 Building FAISS index from {len(documents)} chunks...")
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(vecs)
+    index.add(vecs)
+
+    # Documents exist only here, as the docstore's storage format
+    ids = [str(uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    index_to_docstore_id = dict(enumerate(ids))
+
+    # Vectors are L2-normalized by the encoder, so inner product equals
+    # cosine similarity and no re-normalization happens at query time
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+
     return vectorstore
 
 
@@ -139,17 +307,17 @@ def main():
     print("🚀 Building FAISS Index for Experiment Assistant")
     print("=" * 60)
     
-    # Load documents
-    documents = load_documents()
-    
-    if not documents:
+    # Load chunks
+    texts, metadatas = load_chunks()
+
+    if not texts:
         print("❌ No documents loaded. Exiting.")
         return
-    
-    print(f"\n📊 Total chunks: {len(documents)}")
-    
+
+    print(f"\n📊 Total chunks: {len(texts)}")
+
     # Build index
-    vectorstore = build_index(documents)
+    vectorstore = build_index(texts, metadatas)
     
     # Save index
     save_index(vectorstore, INDEX_DIR)
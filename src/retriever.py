@@ -2,31 +2,80 @@
 Simple FAISS retriever for document search.
 Wraps FAISS vectorstore with a clean interface.
 
-NOTE: This module is primarily used for CLI testing and debugging.
-The main application (app.py) uses FAISS directly via LangChain's
-RetrievalQA chain. This separation allows testing the retrieval
-component independently without launching the full Gradio UI.
+This module owns load_vectorstore, the memory-mapped index loader that
+the main application (app.py) also uses. The SimpleRetriever class and
+the CLI below exist for testing and debugging, so the retrieval
+component can be exercised without launching the full Gradio UI.
 
 Usage:
     python src/retriever.py  # Interactive CLI search
 """
 
 import os
+import pickle
 from pathlib import Path
 from typing import List
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import faiss
+
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
 from dotenv import load_dotenv
 
+try:
+    from src.embeddings import EMBED_MODEL, load_embeddings
+except ImportError:  # running as a script: python src/retriever.py
+    from embeddings import EMBED_MODEL, load_embeddings
+
 load_dotenv()
 
 # Configuration
-EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 INDEX_DIR = Path(os.getenv("INDEX_DIR", "faiss_index"))
 
 
+def load_vectorstore(index_dir: Path, embeddings) -> FAISS:
+    """
+    Load a saved FAISS vectorstore with a memory-mapped index.
+
+    faiss.read_index with IO_FLAG_MMAP lets the OS demand-page the index
+    file and share those pages across processes, instead of each worker
+    deserializing a private copy into RAM.
+    """
+    index_dir = Path(index_dir)
+
+    index = faiss.read_index(
+        str(index_dir / "index.faiss"),
+        faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+    )
+
+    # Same docstore/id-map pickle that FAISS.load_local reads
+    with open(index_dir / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    # Match the wrapper's strategy to the metric actually on disk: the
+    # current indexer builds METRIC_INNER_PRODUCT over pre-normalized
+    # vectors (scores read as cosine similarities, no re-normalization
+    # at query time), but indexes built before that are plain L2
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+    else:
+        print(
+            "⚠️  Index uses the L2 metric (built by an older indexer); "
+            "scores will be distances. Rebuild with 'python src/indexer.py' "
+            "to get the inner-product index."
+        )
+        distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        distance_strategy=distance_strategy,
+    )
+
+
 class SimpleRetriever:
     """Simple FAISS-based retriever for semantic search."""
     
@@ -41,17 +90,10 @@ class SimpleRetriever:
         print(f"📂 Loading FAISS index from: {index_dir}")
         
         # Load embeddings model
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=EMBED_MODEL,
-            encode_kwargs={"normalize_embeddings": True}
-        )
+        self.embeddings = load_embeddings()
         
-        # Load FAISS index
-        self.vectorstore = FAISS.load_local(
-            str(index_dir),
-            self.embeddings,
-            allow_dangerous_deserialization=True
-        )
+        # Load FAISS index (memory-mapped)
+        self.vectorstore = load_vectorstore(index_dir, self.embeddings)
         
         print(f"✅ Retriever ready with {EMBED_MODEL}")
     